@@ -0,0 +1,42 @@
+import tmms.tmms
+import pytest
+
+
+class FakeResponse:
+    """Stands in for requests.Response, either with a json payload or image content."""
+
+    def __init__(self, payload=None, content=b""):
+        self.payload = payload
+        self.content = content
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        yield self.content
+
+
+@pytest.fixture
+def fake_api(monkeypatch):
+    """Replaces requests.get with a handler mapping each url to a payload.
+
+    The handler returns a json payload, bytes for images or raises.
+    Installing it returns the list of requested urls.
+    """
+    def install(handler):
+        calls = []
+
+        def fake_get(url, stream=False, timeout=None):
+            calls.append(url)
+            result = handler(url)
+            if isinstance(result, bytes):
+                return FakeResponse(content=result)
+            return FakeResponse(result)
+
+        monkeypatch.setattr(tmms.tmms.requests, "get", fake_get)
+        return calls
+
+    return install
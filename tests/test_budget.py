@@ -0,0 +1,116 @@
+from tmms.tmms import _RequestBudget, _run_stages, _update_lookup_table, main
+import tmms.tmms
+import pandas as pd
+import pytest
+
+
+def test_budget_unlimited():
+    budget = _RequestBudget()
+    assert budget.schedule(4, "details", [1, 2, 3]) == [1, 2, 3]
+    assert len(budget.deferred_df()) == 0
+
+
+def test_budget_defers():
+    budget = _RequestBudget(3)
+    assert budget.schedule(1, "lookup", ["a", "b"], cost=2) == ["a"]
+    assert budget.schedule(3, "details", [603, 604]) == [603]
+    assert budget.schedule(4, "credits", [603]) == []
+    assert budget.remaining == 0
+
+    deferred = budget.deferred_df()
+    assert deferred["tier"].tolist() == [1, 3, 4]
+    assert deferred["key"].tolist() == ["b", "604", "603"]
+
+
+def test_budget_previous_first():
+    previous = pd.DataFrame.from_dict({"tier": [4], "stage": ["details"], "key": [605]})
+    budget = _RequestBudget(1, previous)
+    assert budget.schedule(4, "details", [603, 604, 605]) == [605]
+
+
+def test_update_lookup_table_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(tmms.tmms, "get_id", lambda api_key, strict, title, year: 603)
+
+    i = tmp_path / "inputfolder"
+    i.mkdir()
+    (i / "The Matrix (1999) (nosubs)").mkdir()
+    o = tmp_path / "output_folder"
+    o.mkdir()
+
+    lookup_df = pd.DataFrame.from_dict({
+        "item": ["The Matrix (1999) (nosubs)"], "tmdb_id": [-1], "tmdb_id_man": [0]})
+    lookup_df.to_csv(o / "tmms_lookuptab.csv", sep=";", index=False)
+
+    (i / "The Matrix Reloaded (2003) (nosubs)").mkdir()
+
+    # new folders come before retries
+    budget = _RequestBudget(1)
+    lookuptab = _update_lookup_table(api_key="api_key", strict=True, input_folder=i,
+                                     output_folder=o, style=0, budget=budget)
+    assert lookuptab.shape == (2, 6)
+    assert lookuptab.set_index("item")["tmdb_id"].to_dict() == {
+        "The Matrix (1999) (nosubs)": -1,
+        "The Matrix Reloaded (2003) (nosubs)": 603}
+    assert budget.deferred == [(2, "lookup", "The Matrix (1999) (nosubs)")]
+
+
+def search_or(payload):
+    # every search finds a movie, everything else returns payload
+    return lambda url: {"results": [{"id": 999}]} if "search/movie" in url else payload
+
+
+@pytest.mark.parametrize("flags, payload", [
+    # the lookups use the whole budget, no details or credits get written
+    (["--max_requests", "2"], {"id": 999, "cast": [], "crew": []}),
+    # the only movie got deleted
+    ([], {"success": False, "status_code": 34, "status_message": "not found"}),
+])
+def test_main_empty_tables(tmp_path, fake_api, flags, payload):
+    fake_api(search_or(payload))
+
+    i = tmp_path / "inputfolder"
+    i.mkdir()
+    (i / "The Matrix (1999) (nosubs)").mkdir()
+    (i / "Alien (1979) (nosubs)").mkdir()
+    o = tmp_path / "output_folder"
+    o.mkdir()
+
+    args = [str(i), "--output_folder", str(o), "--api_key", "api_key", "--style", "0",
+            "--m", "--c"] + flags
+    main(args)
+    # the second run reads the tables written without rows
+    main(args)
+
+    assert (o / "tmms_moviedetails.csv").exists()
+
+
+def test_run_stages_refresh_flags(tmp_path, fake_api):
+    movie = {"adult": False, "id": 603, "imdb_id": "tt0133093", "original_language": "en",
+             "original_title": "The Matrix", "overview": "", "popularity": 79.2,
+             "poster_path": None, "backdrop_path": None, "release_date": "1999-03-30",
+             "budget": 63000000, "revenue": 463517383, "runtime": 136, "status": "Released",
+             "tagline": "", "title": "The Matrix", "video": False, "vote_average": 8.2,
+             "vote_count": 22000, "homepage": "", "genres": [], "production_companies": [],
+             "production_countries": [], "spoken_languages": []}
+    credits = {"id": 603, "crew": [], "cast": [{
+        "adult": False, "gender": 2, "id": 6384, "name": "Keanu Reeves", "cast_id": 34,
+        "character": "Neo", "order": 0}]}
+    person = {"adult": False, "birthday": "1964-09-02", "deathday": None, "gender": 2,
+              "id": 6384, "imdb_id": "nm0000206", "name": "Keanu Reeves",
+              "place_of_birth": "Beirut, Lebanon", "popularity": 52.709}
+
+    def handler(url):
+        if "/person/" in url:
+            return person
+        return credits if "/credits" in url else movie
+
+    fake_api(handler)
+    _run_stages("api_key", [603], tmp_path, _RequestBudget(), {},
+                m=True, c=True, people=False, a=False)
+
+    # neither images nor people refresh stored details or credits
+    calls = fake_api(handler)
+    _run_stages("api_key", [603], tmp_path, _RequestBudget(), {},
+                m=False, c=False, people=True, a=True)
+    assert calls == ["https://api.themoviedb.org/3/person/6384?api_key=api_key&language=en-US"]
+    assert pd.read_csv(tmp_path / "tmms_credits.csv", sep=";")["cc.m.id"].tolist() == [603]
@@ -0,0 +1,148 @@
+from tmms.tmms import get_credits, get_details, _write_dead_letters, _read_dead_letters, _update_details, DETAIL_TABLES
+from tmms.tmms import _attach_assets, _dead_letter, _read_table, _retry_failed, _write_to_disk
+from tmms.tmms import _RequestBudget, _run_stages
+import json
+import pandas as pd
+import pytest
+import requests
+
+NOT_FOUND = {"success": False, "status_code": 34,
+             "status_message": "The resource you requested could not be found."}
+
+
+def by_movie_id(payloads):
+    return lambda url: payloads[int(url.split("/movie/")[1].split("?")[0].split("/")[0])]
+
+
+def test_get_credits_dead_letter(fake_api):
+    payloads = {
+        603: {"id": 603, "cast": [{"adult": False, "gender": 2, "id": 6384, "name": "Keanu Reeves",
+                                   "cast_id": 34, "character": "Neo", "order": 0}], "crew": []},
+        604: NOT_FOUND,
+    }
+    fake_api(by_movie_id(payloads))
+
+    # without collecting failures, the bad id still raises
+    with pytest.raises(ValueError):
+        get_credits("api_key", [603, 604])
+
+    failed = {("credits", "603"): {}}
+    cast_crew = get_credits("api_key", [603, 604], failed=failed)
+
+    assert cast_crew["cc.m.id"].tolist() == [603]
+    # 603 went through this time
+    assert list(failed) == [("credits", "604")]
+    assert json.loads(failed[("credits", "604")]["payload"]) == NOT_FOUND
+
+
+MOVIE = {"adult": False, "backdrop_path": None, "budget": 63000000, "homepage": "", "id": 603,
+         "imdb_id": "tt0133093", "original_language": "en", "original_title": "The Matrix",
+         "overview": "", "popularity": 79.2, "poster_path": "/f89U3ADr1oiB1s9GkdPOEpXUk5H.jpg",
+         "release_date": "1999-03-30", "revenue": 463517383, "runtime": 136,
+         "status": "Released", "tagline": "", "title": "The Matrix", "video": False,
+         "vote_average": 8.2, "vote_count": 22000, "genres": [{"id": 28, "name": "Action"}],
+         "production_companies": [], "production_countries": [], "spoken_languages": []}
+
+
+def test_get_details_dead_letter(fake_api):
+    no_runtime = dict(MOVIE, id=604)
+    no_runtime.pop("runtime")
+
+    fake_api(by_movie_id({603: MOVIE, 604: no_runtime}))
+
+    failed = {}
+    details, genres, prod_comp, prod_count, spoken_langs = get_details(
+        "api_key", [603, 604], failed=failed)
+
+    assert details["m.id"].tolist() == [603]
+    assert details["m.runtime"].dtypes == "int64"
+    assert genres["genres.m.id"].tolist() == [603]
+    assert list(failed) == [("details", "604")]
+    assert "runtime" in failed[("details", "604")]["reason"]
+
+
+def test_update_details_failed_refresh(fake_api):
+    fake_api(by_movie_id({603: MOVIE}))
+
+    failed = {}
+    tables = [pd.DataFrame() for _ in DETAIL_TABLES]
+    tables = _update_details("api_key", [603], tables, failed=failed)
+    assert tables[0]["m.id"].tolist() == [603]
+
+    def timeout(url):
+        raise requests.exceptions.ConnectionError("timeout")
+
+    fake_api(timeout)
+
+    # a failing refresh keeps the previously pulled rows
+    tables = _update_details("api_key", [603], tables, failed=failed)
+    assert list(failed) == [("details", "603")]
+    assert tables[0]["m.id"].tolist() == [603]
+    assert tables[1]["genres.m.id"].tolist() == [603]
+
+
+def test_run_stages_skips_failed(tmp_path, fake_api):
+    calls = fake_api(by_movie_id({603: MOVIE}))
+
+    failed = {("details", "604"): {"stage": "details", "key": "604", "reason": "", "payload": ""},
+              ("credits", "603"): {"stage": "credits", "key": "603", "reason": "", "payload": ""},
+              ("credits", "604"): {"stage": "credits", "key": "604", "reason": "", "payload": ""}}
+    _run_stages("api_key", [603, 604], tmp_path, _RequestBudget(), failed,
+                m=True, c=True, people=False, a=False)
+
+    # dead-lettered ids are left to --retry_failed
+    assert calls == [
+        "https://api.themoviedb.org/3/movie/603?api_key=api_key&include_adult=true&language=en-US"]
+    assert len(failed) == 3
+
+
+def test_dead_letters_roundtrip(tmp_path):
+    failed = {("details", "604"): {"stage": "details", "key": "604",
+                                   "reason": "KeyError: 'runtime'", "payload": "{\"id\": 604}"}}
+    _write_dead_letters(failed, tmp_path)
+    assert _read_dead_letters(tmp_path) == failed
+
+    _write_dead_letters({}, tmp_path)
+    assert (tmp_path / "tmms_failed.csv").exists() is False
+
+
+def test_retry_failed_assets(tmp_path, fake_api):
+    def handler(url):
+        if "image.tmdb.org" in url:
+            return url.encode()
+        return by_movie_id({603: MOVIE, 604: dict(MOVIE, id=604, poster_path="/p604.jpg")})(url)
+
+    calls = fake_api(handler)
+
+    tables = _update_details("api_key", [603], [pd.DataFrame() for _ in DETAIL_TABLES])
+    tables = _attach_assets(tables, tmp_path, "w500")
+    for tab, fname in zip(tables, DETAIL_TABLES):
+        _write_to_disk(tab, fname, tmp_path)
+    poster_603 = tables[0]["m.poster_local_path"][0]
+
+    failed = {}
+    _dead_letter(failed, "details", 604, KeyError("runtime"))
+    calls.clear()
+    _retry_failed("api_key", tmp_path, failed)
+
+    # only the recovered movie's poster, at the size used before
+    assert calls[1:] == ["https://image.tmdb.org/t/p/w500/p604.jpg"]
+    assert failed == {}
+    details = _read_table(tmp_path, "tmms_moviedetails.csv")
+    assert details["m.id"].tolist() == [603, 604]
+    assert details["m.poster_local_path"][0] == poster_603
+    assert details["m.poster_local_path"][1].startswith("tmms_assets/")
+
+
+def test_retry_failed_budget(tmp_path, fake_api):
+    calls = fake_api(lambda url: MOVIE)
+
+    failed = {}
+    _dead_letter(failed, "details", 603, KeyError("runtime"))
+    _dead_letter(failed, "credits", 603, KeyError("id"))
+
+    _retry_failed("api_key", tmp_path, failed, _RequestBudget(1))
+
+    # the credits retry doesnt fit into the budget and stays in the dead letters
+    assert len(calls) == 1
+    assert list(failed) == [("credits", "603")]
@@ -0,0 +1,36 @@
+from tmms.tmms import get_assets
+
+
+def test_get_assets(tmp_path, fake_api):
+    # poster and logo share the same image content
+    calls = fake_api(lambda url: b"backdrop" if "backdrop" in url else b"image")
+
+    paths = ["/poster.jpg", "/backdrop.jpg", "/logo.png", "/poster.jpg", "", "nan"]
+    assets = get_assets(paths, tmp_path, size="w500", workers=2)
+
+    # reused paths only get downloaded once
+    assert len(calls) == 3
+    assert assets.shape == (3, 3)
+    assert (tmp_path / "tmms_assets.csv").exists()
+
+    local = dict(zip(assets["asset.path"], assets["asset.local_path"]))
+    assert local["/poster.jpg"].startswith("tmms_assets/")
+    assert local["/poster.jpg"] != local["/backdrop.jpg"]
+    # identical content ends up in the same file, apart from the suffix
+    assert local["/poster.jpg"][:-4] == local["/logo.png"][:-4]
+    assert len(list((tmp_path / "tmms_assets").glob("*.part"))) == 0
+
+    # second run skips everything already present
+    assets = get_assets(paths, tmp_path, size="w500", workers=2)
+    assert len(calls) == 3
+    assert assets.shape == (3, 3)
+
+
+def test_get_assets_empty_index(tmp_path):
+    # e.g. no movie had an image, the index is written without rows
+    assets = get_assets([], tmp_path)
+    assert assets.shape == (0, 3)
+
+    assets = get_assets(["", "nan"], tmp_path)
+    assert assets.shape == (0, 3)
+    assert assets.columns.tolist() == ["asset.path", "asset.size", "asset.local_path"]
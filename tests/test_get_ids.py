@@ -68,3 +68,11 @@ def test_get_ids_noapikey():
 
 
 # check with malformed entries
+
+
+def test_get_ids_empty():
+    # nothing to look up, e.g. everything deferred by the request budget
+    result = get_ids(api_key="", strict=True, item_names=[], style=0)
+
+    assert result.shape == (0, 2)
+    assert result["tmdb_id"].dtypes == "int64"
@@ -0,0 +1,37 @@
+from tmms.tmms import get_people, _select_people
+import pandas as pd
+
+
+def test_select_people():
+    cast_crew = pd.DataFrame.from_dict({
+        "cc.id": [6384, 2975, 6384, 9339],
+        "cc.order": [0.0, 1.0, None, None],
+        "cc.credit.type": ["cast", "cast", "crew", "crew"]})
+
+    assert _select_people(cast_crew) == [6384, 2975, 9339]
+    assert _select_people(cast_crew, top_cast=1) == [6384]
+    assert _select_people(pd.DataFrame()) == []
+
+
+def test_get_people(fake_api):
+    calls = fake_api(lambda url: {
+        "adult": False,
+        "also_known_as": ["Keanu Charles Reeves"],
+        "birthday": "1964-09-02",
+        "deathday": None,
+        "gender": 2,
+        "id": 6384,
+        "imdb_id": "nm0000206",
+        "name": "Keanu Reeves",
+        "place_of_birth": "Beirut, Lebanon",
+        "popularity": 52.709})
+
+    people = get_people("api_key", [6384, 6384])
+
+    # every person is requested once
+    assert len(calls) == 1
+    assert people.shape == (1, 9)
+    assert "p.also_known_as" not in people.columns
+    assert people["p.id"][0] == 6384
+    assert people["p.imdb_id"][0] == "nm0000206"
+    assert people["p.deathday"][0] == ""
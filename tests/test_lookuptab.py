@@ -1,5 +1,7 @@
 from tmms.tmms import _update_lookup_table
+import tmms.tmms
 import os
+import pandas as pd
 def test_update_lookup_table(tmp_path):
     # tests if lookuptab gets created
     
@@ -18,7 +20,7 @@ def test_update_lookup_table(tmp_path):
     assert file_count == 0
 
     lookuptab = _update_lookup_table(api_key=api_key, strict=strict, input_folder=i, output_folder=o)
-    assert lookuptab.shape==(1,3)
+    assert lookuptab.shape==(1,6)
 
 
     file_count = len(list(o.glob('*.*')))
@@ -29,4 +31,73 @@ def test_update_lookup_table(tmp_path):
     m2.mkdir()
 
     lookuptab = _update_lookup_table(api_key=api_key, strict=strict, input_folder=i, output_folder=o)
-    assert lookuptab.shape==(2,3)
+    assert lookuptab.shape==(2,6)
+
+
+def test_update_lookup_table_rename(tmp_path, monkeypatch):
+    # tests if renamed folders keep their ids without another lookup
+    calls = []
+
+    def fake_get_id(api_key, strict, title, year):
+        calls.append(title)
+        return 603
+
+    monkeypatch.setattr(tmms.tmms, "get_id", fake_get_id)
+
+    i = tmp_path / "inputfolder"
+    i.mkdir()
+    m1 = i / "The Matrix (1999) (nosubs)"
+    m1.mkdir()
+
+    o = tmp_path / "output_folder"
+    o.mkdir()
+
+    lookuptab = _update_lookup_table(api_key="api_key", strict=True, input_folder=i, output_folder=o)
+    assert len(calls) == 1
+
+    # manual override
+    lookuptab["tmdb_id_man"] = 604
+    lookuptab.to_csv(o / "tmms_lookuptab.csv", sep=";", index=False)
+
+    # adding subtitles changes the folder's mtime
+    (m1 / "movie.en.srt").write_text("1")
+    os.utime(m1, ns=(0, os.stat(m1).st_mtime_ns + 10**9))
+    m1.rename(i / "The Matrix (1999) (subs)")
+
+    lookuptab = _update_lookup_table(api_key="api_key", strict=True, input_folder=i, output_folder=o)
+    assert len(calls) == 1
+    assert lookuptab["item"].tolist() == ["The Matrix (1999) (subs)"]
+    assert lookuptab["tmdb_id"].tolist() == [603]
+    assert lookuptab["tmdb_id_man"].tolist() == [604]
+
+
+def test_update_lookup_table_reused_inode(tmp_path, monkeypatch):
+    # tests if a new folder reusing a deleted folder's inode gets looked up
+    calls = []
+
+    def fake_get_id(api_key, strict, title, year):
+        calls.append(title)
+        return 68
+
+    monkeypatch.setattr(tmms.tmms, "get_id", fake_get_id)
+
+    i = tmp_path / "inputfolder"
+    i.mkdir()
+    m1 = i / "Brazil (1985) (nosubs)"
+    m1.mkdir()
+    stat = os.stat(m1)
+
+    o = tmp_path / "output_folder"
+    o.mkdir()
+
+    # "Alien (1979) (nosubs)" got deleted, its inode went to the new folder
+    lookup_df = pd.DataFrame.from_dict({
+        "item": ["Alien (1979) (nosubs)"], "tmdb_id": [348], "tmdb_id_man": [0],
+        "dev": [stat.st_dev], "ino": [stat.st_ino], "mtime": [stat.st_mtime_ns - 10**9]})
+    lookup_df.to_csv(o / "tmms_lookuptab.csv", sep=";", index=False)
+
+    lookuptab = _update_lookup_table(api_key="api_key", strict=True, input_folder=i, output_folder=o)
+    assert calls == ["Brazil"]
+    assert lookuptab.set_index("item")["tmdb_id"].to_dict() == {
+        "Alien (1979) (nosubs)": 348,
+        "Brazil (1985) (nosubs)": 68}
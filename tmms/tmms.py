@@ -7,6 +7,23 @@ import argparse
 import requests  # type: ignore
 import os
 import pathlib
+import hashlib
+import json
+import tempfile
+from typing import Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# detail tables written by the --m flag and their TMDB id column
+DETAIL_TABLES = {
+    "tmms_moviedetails.csv": "m.id",
+    "tmms_genres.csv": "genres.m.id",
+    "tmms_production_companies.csv": "production_companies.m.id",
+    "tmms_production_countries.csv": "production_countries.m.id",
+    "tmms_spoken_languages.csv": "spoken_languages.m.id",
+}
+
+# (stage, key) -> failure, see tmms_failed.csv
+Failures = dict[tuple[str, str], dict[str, str]]
 
 
 def _str_empty(my_string: str) -> bool:
@@ -51,13 +68,171 @@ def _guess_convention(item_names: list[str]) -> int:
     return -1
 
 
-def _update_lookup_table(api_key: str, strict: bool, input_folder: pathlib.Path, output_folder: pathlib.Path, style: int = -1):
+class _RequestBudget:
+    """Keeps track of how many TMDB API requests a run may still send.
+
+    Work is handed out in priority tiers, whatever doesn't fit into the budget
+    is deferred. Deferred work of the previous run is handed out first within
+    its tier, so stale refreshes rotate through the library over several runs.
+
+    Tiers: 1 new folders, 2 retries of tmdb_id == -1, 3 missing data, 4 stale refreshes
+    """
+
+    def __init__(self, max_requests: int | None = None, previous: pd.DataFrame | None = None):
+        """
+        :param max_requests: request budget, None for unlimited
+        :param previous: deferred work of the previous run, see tmms_deferred.csv
+        """
+        self.remaining = max_requests
+        self.deferred: list[tuple[int, str, str]] = []
+        self.previous: set[tuple[str, str]] = set()
+
+        if previous is not None and len(previous) > 0:
+            self.previous = set(
+                zip(previous["stage"].astype(str), previous["key"].astype(str)))
+
+    def schedule(self, tier: int, stage: str, keys: list[Any], cost: int = 1) -> list[Any]:
+        """Hands out as many keys as the budget allows and defers the rest.
+
+        :param tier: priority tier of keys
+        :param stage: stage name, e.g. "lookup" or "details"
+        :param keys: work items of that stage
+        :param cost: worst case number of requests per key
+        :returns: keys to process in this run
+        """
+        keys = sorted(keys, key=lambda k: (stage, str(k)) not in self.previous)
+
+        if self.remaining is None:
+            return keys
+
+        n = min(len(keys), self.remaining // cost)
+        self.remaining -= n * cost
+        self.deferred += [(tier, stage, str(k)) for k in keys[n:]]
+
+        return keys[:n]
+
+    def deferred_df(self) -> pd.DataFrame:
+        """
+        :returns: deferred work as df with tier, stage and key
+        """
+        return pd.DataFrame(self.deferred, columns=["tier", "stage", "key"])
+
+
+def _fingerprint(input_folder: pathlib.Path, item_names: list[str]) -> pd.DataFrame:
+    """Collects a stable identity for every item folder.
+
+    :param input_folder: movie library
+    :param item_names: folder names inside input_folder
+    :returns: df with item, dev, ino and mtime (in ns)
+    """
+    rows = []
+    for item in item_names:
+        stat = os.stat(pathlib.Path(input_folder) / item)
+        rows.append([item, stat.st_dev, stat.st_ino, stat.st_mtime_ns])
+
+    return pd.DataFrame(rows, columns=["item", "dev", "ino", "mtime"])
+
+
+def _refresh_fingerprints(lookup_df: pd.DataFrame, fingerprints: pd.DataFrame) -> pd.DataFrame:
+    """Updates dev, ino and mtime of all present items, vanished ones keep their last one.
+
+    :param lookup_df: lookup table
+    :param fingerprints: output of _fingerprint for the current library
+    :returns: lookup table with fingerprint columns
+    """
+    lookup_df = lookup_df.copy()
+    fingerprints = fingerprints.set_index("item")
+
+    # mtime is in ns, going through float would lose precision
+    for col in ["dev", "ino", "mtime"]:
+        if col not in lookup_df.columns:
+            lookup_df[col] = -1
+        fresh = fingerprints[col].to_dict()
+        lookup_df[col] = pd.Series(
+            [fresh.get(item, -1 if pd.isna(last) else last)
+             for item, last in zip(lookup_df["item"], lookup_df[col])],
+            index=lookup_df.index, dtype="int64")
+
+    return lookup_df
+
+
+def _title_year(item: str) -> tuple[str, str] | None:
+    """Parses title and year from a single item name.
+
+    :param item: folder name
+    :returns: title and year, None if the name fits no style
+    """
+    style = _guess_convention([item])
+    if style == -1:
+        return None
+
+    extract = _extract([item], style).iloc[0]
+    return extract["title"], extract["year"]
+
+
+def _carry_over_renames(stale_items: pd.DataFrame, fingerprints: pd.DataFrame) -> pd.DataFrame:
+    """Renames rows of the lookup table whose folder got renamed or moved.
+
+    A new folder is the same as a vanished one if device, inode and mtime match.
+    Adding e.g. subtitles changes the mtime, so an inode match with another mtime
+    is only trusted if the parsed title and year stay the same, as inodes get
+    reused for new folders. Folders moved to another file system get a new
+    inode, they are recognized if their mtime matches exactly one vanished and
+    one new folder.
+
+    :param stale_items: lookup table of the previous run
+    :param fingerprints: output of _fingerprint for the current library
+    :returns: lookup table with renamed items
     """
+    stale_items = _refresh_fingerprints(stale_items, fingerprints)
+
+    gone = stale_items[~stale_items["item"].isin(fingerprints["item"])]
+    new = fingerprints[~fingerprints["item"].isin(stale_items["item"])]
+
+    by_inode: dict[tuple[int, int], list[int]] = {}
+    for idx, dev, ino in zip(gone.index, gone["dev"], gone["ino"]):
+        if ino != -1:
+            by_inode.setdefault((dev, ino), []).append(idx)
+    gone_mtimes = gone["mtime"].value_counts()
+    new_mtimes = new["mtime"].value_counts()
+    by_mtime = {mtime: idx for idx, mtime in gone["mtime"].items()
+                if mtime != -1 and gone_mtimes[mtime] == 1 and new_mtimes.get(mtime, 0) == 1}
+
+    renamed = set()
+    for row in new.itertuples():
+        candidates = by_inode.get((row.dev, row.ino), [])
+        same_mtime = [idx for idx in candidates if gone.loc[idx, "mtime"] == row.mtime]
+        title_year = _title_year(row.item)
+
+        if len(same_mtime) == 1:
+            idx = same_mtime[0]
+        elif (len(candidates) == 1 and title_year is not None
+              and _title_year(gone.loc[candidates[0], "item"]) == title_year):
+            idx = candidates[0]
+        else:
+            idx = by_mtime.get(row.mtime)
+
+        if idx is not None and idx not in renamed:
+            stale_items.loc[idx, "item"] = row.item
+            renamed.add(idx)
+
+    return stale_items
+
+
+def _update_lookup_table(api_key: str, strict: bool, input_folder: pathlib.Path,
+                         output_folder: pathlib.Path, style: int = -1,
+                         budget: _RequestBudget | None = None):
+    """Looks up new folders and keeps the ids of known ones.
+
+    Folders are recognized by their fingerprint, so renamed or moved folders
+    keep their tmdb_id and tmdb_id_man without another lookup.
+
     :param api_key: TMDB API key
     :param strict:
     :param input_folder: movie library
     :param output_folder: where lookuptable gets written to
     :param style: which style to use for parsing
+    :param budget: request budget, new folders are looked up before retries
     :returns: lookuptable as df
     """
     fresh_items = next(os.walk(input_folder))[1]
@@ -65,28 +240,43 @@ def _update_lookup_table(api_key: str, strict: bool, input_folder: pathlib.Path,
     if len(fresh_items) == 0:
         exit("input folder empty")
 
+    if budget is None:
+        budget = _RequestBudget()
+
+    fingerprints = _fingerprint(input_folder, fresh_items)
     lookuptab = output_folder / "tmms_lookuptab.csv"
 
     if lookuptab.exists() is False:
+        fresh_items = budget.schedule(1, "lookup", sorted(fresh_items), cost=1)
         lookup_df = get_ids(api_key=api_key, strict=True,
                             item_names=fresh_items, style=style)
         lookup_df["tmdb_id_man"] = 0
     else:
         stale_items = pd.read_csv(lookuptab, sep=";", encoding="UTF-8")
+        stale_items = _carry_over_renames(stale_items, fingerprints)
         # its assumed that the TMDB ids are greater or equal than 0
         list_with_ids = stale_items[(stale_items["tmdb_id"] >= 0) | (
             stale_items["tmdb_id_man"] != 0)]
         list_without_ids = stale_items[(stale_items["tmdb_id"] < 0) & (
-            stale_items["tmdb_id_man"] == 0)]["item"].tolist()
-        list_new_items = list(set(list_without_ids) | (
-            set(fresh_items) - set(list_with_ids["item"])))
+            stale_items["tmdb_id_man"] == 0)]
+        list_new_items = sorted(
+            set(fresh_items) - set(list_with_ids["item"]) - set(list_without_ids["item"]))
+
+        cost = 1 if strict else 2
+        list_new_items = budget.schedule(1, "lookup", list_new_items, cost)
+        list_retries = budget.schedule(
+            2, "lookup", sorted(list_without_ids["item"]), cost)
+        # deferred retries stay in the table until the next run
+        list_deferred = list_without_ids[~list_without_ids["item"].isin(list_retries)]
 
         renewed = get_ids(api_key=api_key, strict=strict,
-                          item_names=list_new_items, style=style)
+                          item_names=list_new_items + list_retries, style=style)
         renewed["tmdb_id_man"] = 0
-        lookup_df = pd.concat([list_with_ids, renewed], axis=0)
+        renewed = _refresh_fingerprints(renewed, fingerprints)
+        lookup_df = pd.concat([list_with_ids, list_deferred, renewed], axis=0)
         lookup_df = lookup_df.reset_index(drop=True)
 
+    lookup_df = _refresh_fingerprints(lookup_df, fingerprints)
     lookup_df = lookup_df.sort_values(by="item")
 
     _write_to_disk(lookup_df, "tmms_lookuptab.csv", output_folder)
@@ -196,49 +386,102 @@ def get_ids(api_key: str, strict: bool, item_names: list[str], style: int = -1)
         tmdb_ids.append(new_id)
 
     # append ids and remove extracted columns
-    df["tmdb_id"] = tmdb_ids
+    df["tmdb_id"] = np.array(tmdb_ids, dtype=int)
     df.drop(["title", "year", "subtitles"],
             axis=1, inplace=True, errors="ignore")
 
     return df
 
 
-def get_credits(api_key: str, id_list: list[int], language: str = "en-US") -> pd.DataFrame:
+def _dead_letter(failed: Failures | None, stage: str, key: int | str, error: Exception,
+                 payload: dict[str, Any] | None = None) -> None:
+    """Records a failed item so the rest of the batch can continue.
+
+    If failed is None, failures aren't collected and error is raised instead.
+
+    :param failed: (stage, key) -> failure, see tmms_failed.csv
+    :param stage: stage name, e.g. "details"
+    :param key: TMDB id or file path of the item
+    :param error: what went wrong
+    :param payload: raw API response of the item, if any
     """
+    if failed is None:
+        raise error
+
+    failed[(stage, str(key))] = {
+        "stage": stage,
+        "key": str(key),
+        "reason": f"{type(error).__name__}: {error}",
+        "payload": json.dumps(payload, default=str),
+    }
 
-    :param api_key: TMDB API key
-    :param id_list: list of TMDB ids
-    :returns: credits as dataframe
+
+def _clear_dead_letter(failed: Failures | None, stage: str, key: int | str) -> None:
+    """Removes a previously failed item after it went through.
+
+    :param failed: (stage, key) -> failure
+    :param stage: stage name
+    :param key: TMDB id or file path of the item
     """
-    cast_crew = pd.DataFrame()
+    if failed is not None:
+        failed.pop((stage, str(key)), None)
 
-    for mid in tqdm(id_list, "Credits"):
 
-        url = f"https://api.themoviedb.org/3/movie/{mid}/credits?api_key={api_key}&language={language}"
-        response = requests.get(url).json()
+def _astype_present(df: pd.DataFrame, col_types: dict[str, type]) -> pd.DataFrame:
+    """Casts those columns of df that are present in col_types.
 
-        response["m.id"] = response.pop("id")
+    :param df: dataframe to cast
+    :param col_types: column -> type
+    :returns: df
+    """
+    return df.astype({key: value for key, value in col_types.items() if key in df.columns})
 
-        cast = pd.json_normalize(
-            response,
-            record_path="cast",
-            meta="m.id",
-            errors="ignore",
-        )
 
-        crew = pd.json_normalize(
-            response,
-            record_path="crew",
-            meta="m.id",
-            errors="ignore",
-        )
+def _get_json_many(urls: dict[int, str], workers: int = 8, desc: str = "", stage: str = "",
+                   failed: Failures | None = None) -> dict[int, dict[str, Any]]:
+    """Sends get requests for all urls concurrently.
 
-        cast["credit.type"] = "cast"
-        crew["credit.type"] = "crew"
-        tmp = pd.concat([cast, crew], axis=0)
-        cast_crew = pd.concat([cast_crew, tmp], axis=0)
+    Requests that fail or return a TMDB error body are passed to _dead_letter
+    and left out of the result.
 
-    cast_crew = cast_crew.add_prefix("cc.")
+    :param urls: key -> url, every key is requested once
+    :param workers: number of concurrent requests
+    :param desc: progress bar description
+    :param stage: stage name for failures
+    :param failed: (stage, key) -> failure
+    :returns: key -> json response
+    """
+    responses = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(requests.get, url): key for key, url in urls.items()}
+        for future in tqdm(as_completed(futures), desc=desc, total=len(futures)):
+            key = futures[future]
+            response = None
+            try:
+                response = future.result().json()
+                # e.g. deleted movies: {"success": false, "status_code": 34, ...}
+                if response.get("success") is False:
+                    raise ValueError(response.get("status_message"))
+            except Exception as e:
+                _dead_letter(failed, stage, key, e, response)
+                continue
+            responses[key] = response
+
+    return responses
+
+
+def get_credits(api_key: str, id_list: list[int], language: str = "en-US", workers: int = 8,
+                failed: Failures | None = None) -> pd.DataFrame:
+    """
+
+    :param api_key: TMDB API key
+    :param id_list: list of TMDB ids
+    :param workers: number of concurrent requests
+    :param failed: if supplied, failing ids are collected here instead of raising
+    :returns: credits as dataframe
+    """
+    cast_crew = pd.DataFrame()
 
     col_types = {
         "cc.adult": bool,
@@ -259,9 +502,48 @@ def get_credits(api_key: str, id_list: list[int], language: str = "en-US") -> pd
         "cc.job": str,
     }
 
-    for key, value in col_types.items():
-        if key in cast_crew.columns:
-            cast_crew[key] = cast_crew[key].astype({key: value})
+    id_list = list(dict.fromkeys(id_list))
+    responses = _get_json_many(
+        {mid: f"https://api.themoviedb.org/3/movie/{mid}/credits?api_key={api_key}&language={language}"
+         for mid in id_list},
+        workers, "Credits", "credits", failed)
+
+    for mid in id_list:
+        if mid not in responses:
+            continue
+
+        try:
+            response = dict(responses[mid])
+            response["m.id"] = response.pop("id")
+
+            cast = pd.json_normalize(
+                response,
+                record_path="cast",
+                meta="m.id",
+                errors="ignore",
+            )
+
+            crew = pd.json_normalize(
+                response,
+                record_path="crew",
+                meta="m.id",
+                errors="ignore",
+            )
+
+            cast["credit.type"] = "cast"
+            crew["credit.type"] = "crew"
+            tmp = pd.concat([cast, crew], axis=0)
+            # fail here rather than when casting the whole batch
+            _astype_present(tmp.add_prefix("cc."), col_types)
+        except Exception as e:
+            _dead_letter(failed, "credits", mid, e, responses[mid])
+            continue
+
+        _clear_dead_letter(failed, "credits", mid)
+        cast_crew = pd.concat([cast_crew, tmp], axis=0)
+
+    cast_crew = cast_crew.add_prefix("cc.")
+    cast_crew = _astype_present(cast_crew, col_types)
 
     cast_crew.replace("nan", None, inplace=True)
     cast_crew.replace("None", None, inplace=True)
@@ -269,11 +551,15 @@ def get_credits(api_key: str, id_list: list[int], language: str = "en-US") -> pd
     return cast_crew
 
 
-def get_details(api_key: str, id_list: list[int], language: str = "en-US") -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+def get_details(api_key: str, id_list: list[int], language: str = "en-US", workers: int = 8,
+                failed: Failures | None = None) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame,
+                                                         pd.DataFrame, pd.DataFrame]:
     """
 
     :param api_key: TMDB API key
     :param id_list: list of TMDB ids
+    :param workers: number of concurrent requests
+    :param failed: if supplied, failing ids are collected here instead of raising
     :returns: dfs movie_details, genres, production companies, production countr
     ies, spoken languages
     """
@@ -283,100 +569,590 @@ def get_details(api_key: str, id_list: list[int], language: str = "en-US") -> tu
     prod_count = pd.DataFrame()
     spoken_langs = pd.DataFrame()
 
-    to_unlist = [
-        "genres",
-        "production_companies",
-        "production_countries",
-        "spoken_languages",
-    ]
+    to_unlist = {
+        "genres": {"id": int, "name": str, "m.id": int},
+        "production_companies": {"id": int, "logo_path": str, "name": str,
+                                 "origin_country": str, "m.id": int},
+        "production_countries": {"iso_3166_1": str, "name": str, "m.id": int},
+        "spoken_languages": {"english_name": str, "iso_639_1": str, "name": str, "m.id": int},
+    }
 
-    for mid in tqdm(id_list, "Details"):
+    col_types = {
+        "adult": bool,
+        "backdrop_path": str,
+        "budget": int,
+        "homepage": str,
+        "id": int,
+        "imdb_id": str,
+        "original_language": str,
+        "original_title": str,
+        "overview": str,
+        "popularity": float,
+        "poster_path": str,
+        "release_date": str,
+        "revenue": int,
+        "runtime": int,
+        "status": str,
+        "tagline": str,
+        "title": str,
+        "video": bool,
+        "vote_average": float,
+        "vote_count": int,
+    }
 
-        url = f"https://api.themoviedb.org/3/movie/{mid}?api_key={api_key}&include_adult=true&language={language}"
-        response = requests.get(url).json()
+    id_list = list(dict.fromkeys(id_list))
+    responses = _get_json_many(
+        {mid: f"https://api.themoviedb.org/3/movie/{mid}?api_key={api_key}&include_adult=true&language={language}"
+         for mid in id_list},
+        workers, "Details", "details", failed)
 
-        tmp = pd.json_normalize(
-            response,
-            errors="ignore",
-        )
+    for mid in id_list:
+        if mid not in responses:
+            continue
+        response = responses[mid]
 
-        tmp.drop(
-            [
-                "belongs_to_collection",
-                "genres",
-                "production_companies",
-                "production_countries",
-                "spoken_languages",
-            ],
-            axis=1,
-            inplace=True,
-            errors="ignore",
-        )
+        # cast per item, so e.g. a missing or null runtime only fails this movie
+        try:
+            tmp = pd.json_normalize(
+                response,
+                errors="ignore",
+            )
+
+            tmp.drop(
+                [
+                    "belongs_to_collection",
+                    "genres",
+                    "production_companies",
+                    "production_countries",
+                    "spoken_languages",
+                ],
+                axis=1,
+                inplace=True,
+                errors="ignore",
+            )
 
-        details = pd.concat([details, tmp], axis=0)
+            unlisted = {"details": tmp.astype(col_types)}
 
-        for col in to_unlist:
-            tmp = pd.json_normalize(response, record_path=col)
-            tmp["m.id"] = mid
+            for col, types in to_unlist.items():
+                tmp = pd.json_normalize(response, record_path=col)
+                tmp["m.id"] = mid
+                unlisted[col] = _astype_present(tmp, types)
+        except Exception as e:
+            _dead_letter(failed, "details", mid, e, response)
+            continue
 
-            if col == "genres":
-                genres = pd.concat([genres, tmp], axis=0)
-            elif col == "production_companies":
-                prod_comp = pd.concat([prod_comp, tmp], axis=0)
-            elif col == "production_countries":
-                prod_count = pd.concat([prod_count, tmp], axis=0)
-            elif col == "spoken_languages":
-                spoken_langs = pd.concat([spoken_langs, tmp], axis=0)
+        _clear_dead_letter(failed, "details", mid)
+        details = pd.concat([details, unlisted["details"]], axis=0)
+        genres = pd.concat([genres, unlisted["genres"]], axis=0)
+        prod_comp = pd.concat([prod_comp, unlisted["production_companies"]], axis=0)
+        prod_count = pd.concat([prod_count, unlisted["production_countries"]], axis=0)
+        spoken_langs = pd.concat([spoken_langs, unlisted["spoken_languages"]], axis=0)
 
-    genres = genres.astype({"id": int, "name": str, "m.id": int})
+    genres = _astype_present(genres, to_unlist["genres"])
     genres = genres.add_prefix("genres.")
 
-    prod_comp = prod_comp.astype(
-        {"id": int, "logo_path": str, "name": str,
-            "origin_country": str, "m.id": int}
-    )
+    prod_comp = _astype_present(prod_comp, to_unlist["production_companies"])
     prod_comp = prod_comp.add_prefix("production_companies.")
     prod_comp.replace("None", "", inplace=True)
 
-    prod_count = prod_count.astype(
-        {"iso_3166_1": str, "name": str, "m.id": int})
+    prod_count = _astype_present(prod_count, to_unlist["production_countries"])
     prod_count = prod_count.add_prefix("production_countries.")
 
-    spoken_langs = spoken_langs.astype(
-        {"english_name": str, "iso_639_1": str, "name": str, "m.id": int}
-    )
+    spoken_langs = _astype_present(spoken_langs, to_unlist["spoken_languages"])
     spoken_langs = spoken_langs.add_prefix("spoken_languages.")
 
-    details = details.astype(
-        {
-            "adult": bool,
-            "backdrop_path": str,
-            "budget": int,
-            "homepage": str,
-            "id": int,
-            "imdb_id": str,
-            "original_language": str,
-            "original_title": str,
-            "overview": str,
-            "popularity": float,
-            "poster_path": str,
-            "release_date": str,
-            "revenue": int,
-            "runtime": int,
-            "status": str,
-            "tagline": str,
-            "title": str,
-            "video": bool,
-            "vote_average": float,
-            "vote_count": int,
-        }
-    )
+    details = _astype_present(details, col_types)
     details.replace("None", "", inplace=True)
-    details = details = details.add_prefix("m.")
+    details = details.add_prefix("m.")
 
     return details, genres, prod_comp, prod_count, spoken_langs
 
 
+def _read_table(output_folder: pathlib.Path, fname: str) -> pd.DataFrame:
+    """Reads a table written by _write_to_disk.
+
+    :param output_folder: folder to read from
+    :param fname: file name
+    :returns: df, empty if the file doesnt exist or a stage wrote no rows
+    """
+    path = pathlib.Path(output_folder) / fname
+
+    if path.exists() is False:
+        return pd.DataFrame()
+
+    try:
+        return pd.read_csv(path, sep=";", encoding="UTF-8", decimal=",")
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
+
+
+def _split_ids(id_list: list[int], table: pd.DataFrame, id_col: str) -> tuple[list[int], list[int]]:
+    """Splits id_list into ids missing from table and ids already present.
+
+    :param id_list: list of TMDB ids
+    :param table: previously written table
+    :param id_col: column holding the TMDB id
+    :returns: missing ids, present ids
+    """
+    present = set(table[id_col]) if id_col in table.columns else set()
+
+    missing = [i for i in id_list if i not in present]
+    stale = [i for i in id_list if i in present]
+
+    return missing, stale
+
+
+def _replace_rows(table: pd.DataFrame, fresh: pd.DataFrame, id_col: str,
+                  id_list: list[int]) -> pd.DataFrame:
+    """Replaces all rows of table belonging to id_list with fresh.
+
+    :param table: previously written table
+    :param fresh: newly pulled rows
+    :param id_col: column holding the TMDB id
+    :param id_list: ids that got pulled
+    :returns: df
+    """
+    if id_col in table.columns:
+        table = table[~table[id_col].isin(id_list)]
+
+    return pd.concat([table, fresh], axis=0).reset_index(drop=True)
+
+
+def _pulled_ids(id_list: list[int], failed: Failures | None, stage: str) -> list[int]:
+    """Leaves out ids that failed, their previously written rows are kept.
+
+    :param id_list: ids that were requested
+    :param failed: (stage, key) -> failure
+    :param stage: stage name
+    :returns: ids that came back
+    """
+    if failed is None:
+        return id_list
+
+    return [i for i in id_list if (stage, str(i)) not in failed]
+
+
+def _update_details(api_key: str, id_list: list[int], tables: list[pd.DataFrame], workers: int = 8,
+                    failed: Failures | None = None) -> list[pd.DataFrame]:
+    """Pulls details for id_list and merges them into tables.
+
+    :param api_key: TMDB API key
+    :param id_list: list of TMDB ids
+    :param tables: detail tables in order of DETAIL_TABLES
+    :param workers: number of concurrent requests
+    :param failed: (stage, key) -> failure
+    :returns: updated detail tables
+    """
+    if len(id_list) == 0:
+        return tables
+
+    fresh = get_details(api_key, id_list, workers=workers, failed=failed)
+
+    id_list = _pulled_ids(id_list, failed, "details")
+
+    return [_replace_rows(table, new, id_col, id_list)
+            for table, new, id_col in zip(tables, fresh, DETAIL_TABLES.values())]
+
+
+def _update_credits(api_key: str, id_list: list[int], cast_crew: pd.DataFrame, workers: int = 8,
+                    failed: Failures | None = None) -> pd.DataFrame:
+    """Pulls credits for id_list and merges them into cast_crew.
+
+    :param api_key: TMDB API key
+    :param id_list: list of TMDB ids
+    :param cast_crew: credits table
+    :param workers: number of concurrent requests
+    :param failed: (stage, key) -> failure
+    :returns: updated credits table
+    """
+    if len(id_list) == 0:
+        return cast_crew
+
+    fresh = get_credits(api_key, id_list, workers=workers, failed=failed)
+
+    return _replace_rows(cast_crew, fresh, "cc.m.id", _pulled_ids(id_list, failed, "credits"))
+
+
+def _update_people(api_key: str, person_ids: list[int], people_df: pd.DataFrame, workers: int = 8,
+                   failed: Failures | None = None) -> pd.DataFrame:
+    """Pulls person details for person_ids and merges them into people_df.
+
+    :param api_key: TMDB API key
+    :param person_ids: list of TMDB person ids
+    :param people_df: people table
+    :param workers: number of concurrent requests
+    :param failed: (stage, key) -> failure
+    :returns: updated people table
+    """
+    if len(person_ids) == 0:
+        return people_df
+
+    fresh = get_people(api_key, person_ids, workers=workers, failed=failed)
+
+    return _replace_rows(people_df, fresh, "p.id", _pulled_ids(person_ids, failed, "people"))
+
+
+def _select_people(cast_crew: pd.DataFrame, top_cast: int | None = None) -> list[int]:
+    """Collects the unique person ids from get_credits output.
+
+    :param cast_crew: credits as returned by get_credits
+    :param top_cast: if set, only cast members with cc.order below top_cast are kept
+    :returns: unique person ids in order of appearance
+    """
+    if len(cast_crew) == 0:
+        return []
+
+    if top_cast is not None:
+        cast_crew = cast_crew[(cast_crew["cc.credit.type"] == "cast") & (
+            cast_crew["cc.order"] < top_cast)]
+
+    return list(dict.fromkeys(cast_crew["cc.id"].tolist()))
+
+
+def get_people(api_key: str, id_list: list[int], language: str = "en-US", workers: int = 8,
+               failed: Failures | None = None) -> pd.DataFrame:
+    """Fetches person details like birthday, place of birth and IMDb id.
+
+    :param api_key: TMDB API key
+    :param id_list: list of TMDB person ids, every person is requested once
+    :param workers: number of concurrent requests
+    :param failed: if supplied, failing ids are collected here instead of raising
+    :returns: person details as dataframe
+    """
+    people = pd.DataFrame()
+
+    col_types = {
+        "p.adult": bool,
+        "p.biography": str,
+        "p.birthday": str,
+        "p.deathday": str,
+        "p.gender": int,
+        "p.homepage": str,
+        "p.id": int,
+        "p.imdb_id": str,
+        "p.known_for_department": str,
+        "p.name": str,
+        "p.place_of_birth": str,
+        "p.popularity": float,
+        "p.profile_path": str,
+    }
+
+    id_list = list(dict.fromkeys(id_list))
+    responses = _get_json_many(
+        {pid: f"https://api.themoviedb.org/3/person/{pid}?api_key={api_key}&language={language}"
+         for pid in id_list},
+        workers, "People ", "people", failed)
+
+    for pid in id_list:
+        if pid not in responses:
+            continue
+
+        try:
+            tmp = pd.DataFrame([responses[pid]])
+            tmp.drop(["also_known_as"], axis=1, inplace=True, errors="ignore")
+            tmp = _astype_present(tmp.add_prefix("p."), col_types)
+        except Exception as e:
+            _dead_letter(failed, "people", pid, e, responses[pid])
+            continue
+
+        _clear_dead_letter(failed, "people", pid)
+        people = pd.concat([people, tmp], axis=0)
+
+    people = _astype_present(people, col_types).reset_index(drop=True)
+    people.replace("None", "", inplace=True)
+
+    return people
+
+
+def _download_asset(path: str, size: str, asset_folder: pathlib.Path) -> str:
+    """Downloads a single TMDB image into the content-addressed asset store.
+
+    The image is streamed into a temporary file and then moved to
+    <sha256 of content><suffix>, so identical images are stored only once and
+    an aborted download never leaves a truncated file behind.
+
+    :param path: TMDB file path, e.g. "/f89U3ADr1oiB1s9GkdPOEpXUk5H.jpg"
+    :param size: TMDB image size, e.g. "w500" or "original"
+    :param asset_folder: root of the asset store
+    :returns: file name inside asset_folder
+    """
+    url = f"https://image.tmdb.org/t/p/{size}{path}"
+    response = requests.get(url, stream=True, timeout=60)
+    response.raise_for_status()
+
+    digest = hashlib.sha256()
+    fd, tmp_name = tempfile.mkstemp(dir=asset_folder, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(chunk_size=65536):
+                digest.update(chunk)
+                f.write(chunk)
+        fname = digest.hexdigest() + pathlib.PurePosixPath(path).suffix
+        os.replace(tmp_name, asset_folder / fname)
+    except BaseException:
+        pathlib.Path(tmp_name).unlink(missing_ok=True)
+        raise
+
+    return fname
+
+
+def get_assets(paths: list[str], output_folder: pathlib.Path, size: str = "original",
+               workers: int = 8, failed: Failures | None = None) -> pd.DataFrame:
+    """Downloads TMDB images (posters, backdrops, logos) into output_folder/tmms_assets.
+
+    paths are deduplicated before downloading. Paths already listed in
+    tmms_assets.csv for the same size, whose file is still present, are skipped.
+    The index is written even if the run gets interrupted, so the next run
+    resumes where this one stopped.
+
+    :param paths: TMDB file paths, empty or missing paths are ignored
+    :param output_folder: folder holding tmms_assets.csv and tmms_assets/
+    :param size: TMDB image size
+    :param workers: number of concurrent downloads
+    :param failed: if supplied, failing paths are collected here instead of raising
+    :returns: df with asset.path, asset.size, asset.local_path for size
+    """
+    output_folder = pathlib.Path(output_folder)
+    asset_folder = output_folder / "tmms_assets"
+    asset_folder.mkdir(exist_ok=True)
+    index_file = output_folder / "tmms_assets.csv"
+    index_cols = ["asset.path", "asset.size", "asset.local_path"]
+
+    if index_file.exists():
+        index = pd.read_csv(index_file, sep=";", encoding="UTF-8", dtype=str)
+        present = index["asset.local_path"].map(
+            lambda p: (output_folder / p).exists())
+        index = index.loc[present.astype(bool)]
+    else:
+        index = pd.DataFrame(columns=index_cols)
+
+    done = set(index.loc[index["asset.size"] == size, "asset.path"])
+    todo = [p for p in dict.fromkeys(paths)
+            if isinstance(p, str) and p.startswith("/") and p not in done]
+
+    new_rows = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_download_asset, p, size, asset_folder): p for p in todo}
+            for future in tqdm(as_completed(futures), desc="Assets ", total=len(futures)):
+                path = futures[future]
+                try:
+                    fname = future.result()
+                except Exception as e:
+                    _dead_letter(failed, "assets", path, e, {"size": size})
+                    continue
+                _clear_dead_letter(failed, "assets", path)
+                new_rows.append([path, size, f"{asset_folder.name}/{fname}"])
+    finally:
+        index = pd.concat(
+            [index, pd.DataFrame(new_rows, columns=index_cols)], axis=0)
+        index = index.reset_index(drop=True)
+        _write_to_disk(index, "tmms_assets.csv", output_folder)
+
+    return index[index["asset.size"] == size].reset_index(drop=True)
+
+
+def _attach_assets(detail_tabs: list[pd.DataFrame], output_folder: pathlib.Path,
+                   size: str = "original", workers: int = 8, failed: Failures | None = None,
+                   paths: list[str] | None = None) -> list[pd.DataFrame]:
+    """Downloads images and adds their local paths to the detail tables.
+
+    :param detail_tabs: detail tables in order of DETAIL_TABLES
+    :param output_folder: folder holding the asset store
+    :param size: TMDB image size
+    :param workers: number of concurrent downloads
+    :param failed: (stage, key) -> failure
+    :param paths: paths to download, defaults to every poster, backdrop and logo
+    :returns: detail tables
+    """
+    details, prod_comp = detail_tabs[0], detail_tabs[2]
+
+    if paths is None:
+        paths = (details.get("m.poster_path", pd.Series(dtype=str)).tolist()
+                 + details.get("m.backdrop_path", pd.Series(dtype=str)).tolist()
+                 + prod_comp.get("production_companies.logo_path", pd.Series(dtype=str)).tolist())
+
+    assets = get_assets(paths, output_folder, size, workers, failed)
+    local_paths = dict(zip(assets["asset.path"], assets["asset.local_path"]))
+
+    # paths without an image of this size keep their previous local path
+    for tab, col in [(details, "m.poster"), (details, "m.backdrop"),
+                     (prod_comp, "production_companies.logo")]:
+        if len(tab) == 0:
+            continue
+        local = tab[f"{col}_path"].map(local_paths)
+        if f"{col}_local_path" in tab.columns:
+            local = local.fillna(tab[f"{col}_local_path"])
+        tab[f"{col}_local_path"] = local
+
+    return detail_tabs
+
+
+def _read_dead_letters(output_folder: pathlib.Path) -> Failures:
+    """Reads failures of previous runs from tmms_failed.csv.
+
+    :param output_folder: folder to read from
+    :returns: (stage, key) -> failure
+    """
+    failed_df = _read_table(output_folder, "tmms_failed.csv")
+
+    failed: Failures = {}
+    for row in failed_df.to_dict("records"):
+        row["key"] = str(row["key"])
+        failed[(row["stage"], row["key"])] = row
+
+    return failed
+
+
+def _write_dead_letters(failed: Failures, output_folder: pathlib.Path) -> None:
+    """Writes failures to tmms_failed.csv, removes the file once nothing fails anymore.
+
+    :param failed: (stage, key) -> failure
+    :param output_folder: folder to write to
+    """
+    if len(failed) > 0:
+        failed_df = pd.DataFrame(list(failed.values()),
+                                 columns=["stage", "key", "reason", "payload"])
+        _write_to_disk(failed_df, "tmms_failed.csv", output_folder)
+    elif (pathlib.Path(output_folder) / "tmms_failed.csv").exists():
+        (pathlib.Path(output_folder) / "tmms_failed.csv").unlink()
+
+
+def _retry_failed(api_key: str, output_folder: pathlib.Path, failed: Failures,
+                  budget: _RequestBudget | None = None, size: str = "original",
+                  workers: int = 8) -> None:
+    """Reprocesses only the items listed in tmms_failed.csv.
+
+    Tables are only rewritten for stages that had failures.
+
+    :param api_key: TMDB API key
+    :param output_folder: folder holding the tables
+    :param failed: (stage, key) -> failure, updated in place
+    :param budget: request budget, items are retried as missing data
+    :param size: TMDB image size, if tmms_assets.csv doesnt tell the size used before
+    :param workers: number of concurrent requests
+    """
+    if budget is None:
+        budget = _RequestBudget()
+
+    keys: dict[str, list[str]] = {}
+    for stage, key in list(failed):
+        keys.setdefault(stage, []).append(key)
+
+    if "details" in keys or "assets" in keys:
+        detail_tabs = [_read_table(output_folder, fname) for fname in DETAIL_TABLES]
+        ids = budget.schedule(3, "details", [int(k) for k in keys.get("details", [])])
+        detail_tabs = _update_details(api_key, ids, detail_tabs, workers, failed)
+
+        # images of recovered movies and failed images, at the size used before
+        index = _read_table(output_folder, "tmms_assets.csv")
+        if len(index) > 0:
+            size = index["asset.size"].mode()[0]
+
+        asset_paths: dict[str, list[str]] = {}
+        if "m.poster_local_path" in detail_tabs[0].columns:
+            details, prod_comp = detail_tabs[0], detail_tabs[2]
+            recovered = _pulled_ids(ids, failed, "details")
+            details = details[details["m.id"].isin(recovered)]
+            if len(prod_comp) > 0:
+                prod_comp = prod_comp[prod_comp["production_companies.m.id"].isin(recovered)]
+            asset_paths[size] = (
+                details["m.poster_path"].tolist() + details["m.backdrop_path"].tolist()
+                + prod_comp.get("production_companies.logo_path", pd.Series(dtype=str)).tolist())
+        for path in keys.get("assets", []):
+            payload = json.loads(failed[("assets", path)]["payload"]) or {}
+            asset_paths.setdefault(payload.get("size", size), []).append(path)
+
+        for asset_size, paths in asset_paths.items():
+            detail_tabs = _attach_assets(
+                detail_tabs, output_folder, asset_size, workers, failed, paths)
+
+        for tab, fname in zip(detail_tabs, DETAIL_TABLES):
+            _write_to_disk(tab, fname, output_folder)
+
+    if "credits" in keys:
+        ids = budget.schedule(3, "credits", [int(k) for k in keys["credits"]])
+        cast_crew = _update_credits(
+            api_key, ids, _read_table(output_folder, "tmms_credits.csv"), workers, failed)
+        _write_to_disk(cast_crew, "tmms_credits.csv", output_folder)
+
+    if "people" in keys:
+        ids = budget.schedule(3, "people", [int(k) for k in keys["people"]])
+        people_df = _update_people(
+            api_key, ids, _read_table(output_folder, "tmms_people.csv"), workers, failed)
+        _write_to_disk(people_df, "tmms_people.csv", output_folder)
+
+
+def _run_stages(api_key: str, unique_ids: list[int], output_folder: pathlib.Path,
+                budget: _RequestBudget, failed: Failures, m: bool, c: bool, people: bool, a: bool,
+                top_cast: int | None = None, asset_size: str = "original",
+                workers: int = 8) -> None:
+    """Pulls details, credits, people and images and writes their tables.
+
+    Missing details, credits and people are pulled before stale details and
+    credits get refreshed. Stale details are only refreshed with ``m`` and
+    stale credits only with ``c``. Ids that already failed are left to
+    ``--retry_failed``.
+
+    :param api_key: TMDB API key
+    :param unique_ids: TMDB ids of the library
+    :param output_folder: folder holding the tables
+    :param budget: request budget
+    :param failed: (stage, key) -> failure
+    :param m: pull movie details
+    :param c: pull credits
+    :param people: pull person details
+    :param a: download images
+    :param top_cast: if set, only the top billed cast is pulled
+    :param asset_size: TMDB image size
+    :param workers: number of concurrent requests
+    """
+    if m or a:
+        detail_tabs = [_read_table(output_folder, fname) for fname in DETAIL_TABLES]
+        detail_tabs = [tab[tab[id_col].isin(unique_ids)].reset_index(drop=True)
+                       if id_col in tab.columns else tab
+                       for tab, id_col in zip(detail_tabs, DETAIL_TABLES.values())]
+        missing, stale_details = _split_ids(unique_ids, detail_tabs[0], "m.id")
+        missing = _pulled_ids(missing, failed, "details")
+        detail_tabs = _update_details(
+            api_key, budget.schedule(3, "details", missing), detail_tabs, workers, failed)
+
+    if c or people:
+        cast_crew = _read_table(output_folder, "tmms_credits.csv")
+        if "cc.m.id" in cast_crew.columns:
+            cast_crew = cast_crew[cast_crew["cc.m.id"].isin(unique_ids)].reset_index(drop=True)
+        missing, stale_credits = _split_ids(unique_ids, cast_crew, "cc.m.id")
+        missing = _pulled_ids(missing, failed, "credits")
+        cast_crew = _update_credits(
+            api_key, budget.schedule(3, "credits", missing), cast_crew, workers, failed)
+
+    if people:
+        people_df = _read_table(output_folder, "tmms_people.csv")
+        missing, _ = _split_ids(_select_people(cast_crew, top_cast), people_df, "p.id")
+        missing = _pulled_ids(missing, failed, "people")
+        people_df = _update_people(
+            api_key, budget.schedule(3, "people", missing), people_df, workers, failed)
+        _write_to_disk(people_df, "tmms_people.csv", output_folder)
+
+    if m:
+        detail_tabs = _update_details(
+            api_key, budget.schedule(4, "details", stale_details), detail_tabs, workers, failed)
+
+    if c:
+        cast_crew = _update_credits(
+            api_key, budget.schedule(4, "credits", stale_credits), cast_crew, workers, failed)
+
+    if c or people:
+        _write_to_disk(cast_crew, "tmms_credits.csv", output_folder)
+
+    if a:
+        detail_tabs = _attach_assets(detail_tabs, output_folder, asset_size, workers, failed)
+
+    if m or a:
+        for tab, fname in zip(detail_tabs, DETAIL_TABLES):
+            _write_to_disk(tab, fname, output_folder)
+
+
 def _write_to_disk(df: pd.DataFrame, fname: str, output_path: pathlib.Path):
     """Write df to output_path with European settings.
 
@@ -408,6 +1184,20 @@ def main(argv=None):
                         help="set flag for pulling movie detail data")
     parser.add_argument("--c", action="store_true",
                         help="set flag for pulling credit data")
+    parser.add_argument("--people", action="store_true",
+                        help="set flag for pulling person details of everyone in the credits")
+    parser.add_argument("--top_cast", type=int, required=False,
+                        help="only pull person details for the top billed cast by cc.order")
+    parser.add_argument("--a", action="store_true",
+                        help="set flag for downloading poster, backdrop and logo images")
+    parser.add_argument("--asset_size", type=str, default="original",
+                        required=False, help="TMDB image size, e.g. w500")
+    parser.add_argument("--workers", type=int, default=8,
+                        required=False, help="number of concurrent requests")
+    parser.add_argument("--max_requests", type=int, required=False,
+                        help="maximum number of TMDB API requests for this run")
+    parser.add_argument("--retry_failed", action="store_true",
+                        help="set flag for only reprocessing items listed in tmms_failed.csv")
     parser.add_argument("--s", action="store_true",
                         help="set flag for no more lookups")
     parser.add_argument("--style", dest="style", type=int,
@@ -419,6 +1209,13 @@ def main(argv=None):
     api_key = args.api_key
     m = args.m
     c = args.c
+    people = args.people
+    top_cast = args.top_cast
+    a = args.a
+    asset_size = args.asset_size
+    workers = args.workers
+    max_requests = args.max_requests
+    retry_failed = args.retry_failed
     strict = args.s
     style = args.style
 
@@ -440,14 +1237,24 @@ def main(argv=None):
     elif not(output_folder.is_dir() or output_folder.exists()):
         exit("output folder doesnt exist or is not a directory")
 
+    failed = _read_dead_letters(output_folder)
+    budget = _RequestBudget(
+        max_requests, _read_table(output_folder, "tmms_deferred.csv"))
+
+    if retry_failed:
+        # items that dont fit into the budget stay in tmms_failed.csv
+        _retry_failed(api_key, output_folder, failed, budget, asset_size, workers)
+        _write_dead_letters(failed, output_folder)
+        return
+
     # update or create lookup table
     lookup_df = _update_lookup_table(
-        api_key, strict, input_folder, output_folder, style
+        api_key, strict, input_folder, output_folder, style, budget
     )
     _write_to_disk(lookup_df, "tmms_lookuptab.csv",  output_folder)
 
     # get ids to lookup
-    if m or c:
+    if m or c or a or people:
         unique_ids: list[int] = np.ndarray.tolist(
             np.where(
                 lookup_df["tmdb_id_man"] != 0,
@@ -459,23 +1266,13 @@ def main(argv=None):
         unique_ids = list(dict.fromkeys(unique_ids))
         unique_ids.remove(-1) if -1 in unique_ids else None
 
-    if m:
-        details, genres, prod_comp, prod_count, spoken_langs = get_details(
-            api_key, unique_ids
-        )
+        _run_stages(api_key, unique_ids, output_folder, budget, failed,
+                    m, c, people, a, top_cast, asset_size, workers)
 
-        _write_to_disk(details, "tmms_moviedetails.csv", output_folder)
-        _write_to_disk(genres, "tmms_genres.csv", output_folder)
-        _write_to_disk(
-            prod_comp, "tmms_production_companies.csv", output_folder)
-        _write_to_disk(
-            prod_count, "tmms_production_countries.csv", output_folder)
-        _write_to_disk(
-            spoken_langs, "tmms_spoken_languages.csv", output_folder)
+    if max_requests is not None:
+        _write_to_disk(budget.deferred_df(), "tmms_deferred.csv", output_folder)
 
-    if c:
-        cast_crew = get_credits(api_key, unique_ids)
-        _write_to_disk(cast_crew, "tmms_credits.csv", output_folder)
+    _write_dead_letters(failed, output_folder)
 
 
 if __name__ == "__main__":